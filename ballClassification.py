@@ -1,6 +1,14 @@
+import functools
 import pandas as pd
 import numpy as np
 
+
+@functools.lru_cache(maxsize=4)
+def _feature_columns(target_length):
+    """依 target_length 產生 (並快取) 模型訓練時使用的欄位名稱。"""
+    return [f'x_{i}' for i in range(target_length)] + [f'y_{i}' for i in range(target_length)]
+
+
 def classify_ball_quality(ball_json, model, target_length=239):
     """
     這個函數ball_json就是棒球api回傳的json檔案
@@ -8,47 +16,36 @@ def classify_ball_quality(ball_json, model, target_length=239):
     輸出浮點數代表是好球的機率
     """
     results = ball_json['results']
-    x_list = []
-    y_list = []
-
-    for item in results:
-        coords = item[1]
-        # Check if coords is not None and has 4 elements
-        if coords is not None and len(coords) == 4:
-            x1, y1, x2, y2 = coords
-            # Ensure all coordinates are not None. If any are, append None.
-            if all(c is not None for c in [x1, y1, x2, y2]):
-                center_x = (x1 + x2) / 2
-                center_y = (y1 + y2) / 2
-                x_list.append(center_x)
-                y_list.append(center_y)
-            else:
-                x_list.append(None)
-                y_list.append(None)
-        else:
-            # If coords itself is None or malformed, append None
-            x_list.append(None)
-            y_list.append(None)
-
-    # Pad with None values until target_length
-    while len(x_list) < target_length:
-        x_list.append(None)
-        y_list.append(None)
-
-    # Truncate to target_length (as a safeguard)
-    x_list = x_list[:target_length]
-    y_list = y_list[:target_length]
-
-    # Create column names
-    columns = [f'x_{i}' for i in range(target_length)] + [f'y_{i}' for i in range(target_length)]
-    values = x_list + y_list
-    
-    # Create DataFrame. Pandas can handle None, which will become NaN.
-    df = pd.DataFrame([values], columns=columns)
+
+    # 一次把所有框轉成 (N, 4) 的浮點陣列；框為 None 或格式不對時整列填 NaN，
+    # 框內個別座標為 None 時 NumPy 會自動轉成 NaN，並讓整列都視為缺值
+    missing = (np.nan,) * 4
+    coords = np.array(
+        [item[1] if item[1] is not None and len(item[1]) == 4 else missing for item in results],
+        dtype=np.float64
+    ).reshape(-1, 4)
+    coords[np.isnan(coords).any(axis=1)] = np.nan
+
+    # 向量化計算每個框的中心點 (x, y)
+    centers = 0.5 * (coords[:, :2] + coords[:, 2:])
+
+    # 不足 target_length 的部分補 NaN，超過的部分截斷
+    if len(centers) < target_length:
+        padding = np.full((target_length - len(centers), 2), np.nan)
+        centers = np.concatenate([centers, padding])
+    centers = centers[:target_length]
+
+    values = np.concatenate([centers[:, 0], centers[:, 1]])[None, :]
+
+    # 只有在模型仍帶有欄位名稱時才需要包成 DataFrame，否則直接餵連續記憶體的 (1, 2N) ndarray
+    if getattr(model, 'feature_names_in_', None) is not None:
+        features = pd.DataFrame(values, columns=_feature_columns(target_length), copy=False)
+    else:
+        features = np.ascontiguousarray(values)
 
     # Note: Many machine learning models, including RandomForest, do not natively
     # handle NaN values. You might need to impute or handle these NaNs before prediction.
     # For demonstration, I'm leaving it as is, assuming your model or pipeline
-    # is set up to handle potential NaNs (which Pandas will convert from None).
-    
-    return float(model.predict_proba(df)[0][0])
\ No newline at end of file
+    # is set up to handle potential NaNs.
+
+    return float(model.predict_proba(features)[0, 0])
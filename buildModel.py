@@ -2,52 +2,67 @@
 # 職責: 從資料庫根據指定條件撈取訓練數據，建立統計模型，並將模型存回資料庫。
 
 import json
+import numpy as np
 import pandas as pd
-from sqlalchemy import or_, and_
+from sqlalchemy import or_, and_, select
 from databaseSetup import SessionLocal, PitchRecording, Kinematics, PitchModel
 
-def create_pitch_profile(features_data: list) -> dict:
+# 建模使用的特徵欄位 (與 kinematics 資料表的欄位名稱一致)
+FEATURE_COLUMNS = [
+    'trunk_flexion_excursion', 'pelvis_obliquity_at_fc',
+    'trunk_rotation_at_br', 'shoulder_abduction_at_br',
+    'trunk_flexion_at_br', 'trunk_lateral_flexion_at_hs',
+    'release_frame', 'landing_frame', 
+    'shoulder_frame', 'total_frames'
+]
+
+def create_pitch_profile(features_data) -> dict:
     """
     從一系列特徵資料中，為每個特徵建立一個統計模型 (使用百分位數法)。
+    features_data 可以是 list[dict]，或是依 FEATURE_COLUMNS 順序排列的列資料
+    (例如直接從資料庫撈出的 Row tuple)。
     """
-    if not features_data:
+    if len(features_data) == 0:
         print("警告：沒有提供任何特徵資料，無法建立模型。")
         return {}
     
-    df = pd.DataFrame(features_data)
-    
     profile = {}
-    feature_columns = [
-        'trunk_flexion_excursion', 'pelvis_obliquity_at_fc',
-        'trunk_rotation_at_br', 'shoulder_abduction_at_br',
-        'trunk_flexion_at_br', 'trunk_lateral_flexion_at_hs',
-        'release_frame', 'landing_frame', 
-        'shoulder_frame', 'total_frames'
-    ]
-    
-    for col_name in feature_columns:
-        if col_name not in df.columns:
-            continue
-            
-        valid_values = df[col_name].dropna()
-        
-        if len(valid_values) < 2:
+
+    # 一次把所有特徵疊成 (N, 特徵數) 的浮點陣列，缺值 (None 或缺欄位) 皆為 NaN
+    # dict 資料用 reindex 一次投影到 FEATURE_COLUMNS；Row tuple 已依欄位排好，直接轉陣列
+    if isinstance(features_data[0], dict):
+        arr = (pd.DataFrame(features_data)
+               .reindex(columns=FEATURE_COLUMNS)
+               .to_numpy(dtype=np.float64, na_value=np.nan))
+    else:
+        arr = np.array(features_data, dtype=np.float64)
+
+    # 有效數據不足 2 筆的特徵直接跳過
+    valid_counts = np.sum(~np.isnan(arr), axis=0)
+    for col_name, count in zip(FEATURE_COLUMNS, valid_counts):
+        if count < 2:
             print(f"警告：特徵 '{col_name}' 的有效數據不足，已跳過。")
-            continue
+    kept = valid_counts >= 2
+    if not kept.any():
+        return {}
+    kept_columns = [col_name for col_name, keep in zip(FEATURE_COLUMNS, kept) if keep]
+    arr = arr[:, kept]
 
-        p10 = valid_values.quantile(0.10)
-        p90 = valid_values.quantile(0.90)
-        
-        stats = {
-            'min': round(p10, 4),
-            'max': round(p90, 4),
-            'p10': round(p10, 4),
-            'p50_median': round(valid_values.median(), 4),
-            'p90': round(p90, 4),
-            'mean': round(valid_values.mean(), 4),
-            'std': round(valid_values.std(), 4)
+    # 批次計算所有特徵的百分位數、平均與標準差 (std 與 pandas 一致使用 ddof=1)
+    p10, p50, p90 = np.nanpercentile(arr, [10, 50, 90], axis=0)
+    means = np.nanmean(arr, axis=0)
+    stds = np.nanstd(arr, axis=0, ddof=1)
+
+    for i, col_name in enumerate(kept_columns):
+        profile[col_name] = {
+            'min': round(float(p10[i]), 4),
+            'max': round(float(p90[i]), 4),
+            'p10': round(float(p10[i]), 4),
+            'p50_median': round(float(p50[i]), 4),
+            'p90': round(float(p90[i]), 4),
+            'mean': round(float(means[i]), 4),
+            'std': round(float(stds[i]), 4)
         }
-        profile[col_name] = stats
             
     return profile
 
@@ -89,10 +104,14 @@ if __name__ == "__main__":
         if TARGET_PITCH_TYPE:
             query_conditions.append(PitchRecording.pitch_type == TARGET_PITCH_TYPE)
         
-        # 執行查詢
-        good_pitches_query = db.query(Kinematics).join(PitchRecording).filter(and_(*query_conditions))
+        # 執行查詢：只撈取建模需要的特徵欄位，不建立完整的 ORM 物件
+        good_pitches_stmt = (
+            select(*[getattr(Kinematics, col_name) for col_name in FEATURE_COLUMNS])
+            .join(PitchRecording)
+            .where(and_(*query_conditions))
+        )
         
-        features_list = [p.__dict__ for p in good_pitches_query.all()]
+        features_list = db.execute(good_pitches_stmt).all()
 
         if not features_list:
             print("❌ 錯誤：在資料庫中找不到符合條件的訓練資料，無法建立模型。")
@@ -1,8 +1,9 @@
 # 檔案: crud.py
 # 職責: 作為資料庫的唯一接口 (數據庫管家)，提供所有資料的增刪改查功能。
 
+from sqlalchemy import Row
 from sqlalchemy.orm import Session
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Sequence
 
 from databaseSetup import PitchAnalyses, PitchModel
 from models import PitchAnalysisUpdate
@@ -10,6 +11,20 @@ from models import PitchAnalysisUpdate
 
 # --- 針對 PitchAnalyses (單次測試結果) 的操作 ---
 
+# 歷史紀錄 API (/history/) 回傳的欄位，順序即回傳 JSON 的欄位順序
+PITCH_ANALYSIS_HISTORY_COLUMNS = (
+    PitchAnalyses.id,
+    PitchAnalyses.video_path,
+    PitchAnalyses.max_speed_kmh,
+    PitchAnalyses.pitch_score,
+    PitchAnalyses.ball_score,
+    PitchAnalyses.biomechanics_features,
+    PitchAnalyses.pitcher_name,
+    PitchAnalyses.release_frame_url,
+    PitchAnalyses.landing_frame_url,
+    PitchAnalyses.shoulder_frame_url,
+)
+
 def get_pitch_analysis(db: Session, analysis_id: int) -> Optional[PitchAnalyses]:
     """根據 ID 獲取單筆分析紀錄。"""
     return db.query(PitchAnalyses).filter(PitchAnalyses.id == analysis_id).first()
@@ -23,6 +38,17 @@ def get_pitch_analyses(db: Session, pitcher_name: Optional[str] = None, skip: in
         query = query.filter(PitchAnalyses.pitcher_name == pitcher_name)
     return query.offset(skip).limit(limit).all()
 
+def get_pitch_analysis_rows(db: Session, pitcher_name: Optional[str] = None, skip: int = 0, limit: int = 100,
+                            columns: Sequence = PITCH_ANALYSIS_HISTORY_COLUMNS) -> List[Row]:
+    """
+    與 get_pitch_analyses 相同的查詢條件，但只 SELECT 指定的欄位並直接回傳 Row，
+    不建立 ORM 物件，適合唯讀的列表 API。
+    """
+    query = db.query(PitchAnalyses).with_entities(*columns).order_by(PitchAnalyses.id.desc())
+    if pitcher_name:
+        query = query.filter(PitchAnalyses.pitcher_name == pitcher_name)
+    return query.offset(skip).limit(limit).all()
+
 def create_pitch_analysis(db: Session, analysis_data: Dict[str, Any]) -> PitchAnalyses:
     """
     根據傳入的字典，建立一筆新的分析紀錄。
@@ -1,7 +1,8 @@
 # 檔案: database_setup.py
 import os
-from sqlalchemy import (create_engine, Column, Integer, String, Float, JSON,
-                        DateTime, ForeignKey)
+from sqlalchemy import (create_engine, Column, Integer, String, Float,
+                        DateTime, ForeignKey, Index, DDL, event, text)
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.orm import sessionmaker, relationship, declarative_base
 from sqlalchemy.sql import func
 
@@ -17,6 +18,13 @@ SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 # 表一：儲存「訓練用」的原始投球紀錄
 class PitchRecording(Base):
     __tablename__ = 'pitch_record'
+    __table_args__ = (
+        # buildModel.py 以「投手 + 球種」篩選訓練資料
+        Index('ix_pr_player_type', 'player_name', 'pitch_type'),
+        # description 的 ILIKE '%strike%' 需要 pg_trgm 的 GIN 索引才不會全表掃描
+        Index('ix_pr_desc_trgm', 'description',
+              postgresql_using='gin', postgresql_ops={'description': 'gin_trgm_ops'}),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     player_name = Column(String, index=True)
@@ -24,7 +32,7 @@ class PitchRecording(Base):
     video_filename = Column(String, unique=True, index=True)
     description = Column(String)
     source_csv = Column(String)
-    keypoints_data = Column(JSON, nullable=True)
+    keypoints_data = Column(JSONB, nullable=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
     kinematics = relationship("Kinematics", back_populates="pitch_recording", cascade="all, delete-orphan")
@@ -49,6 +57,10 @@ class Kinematics(Base):
 
     pitch_recording = relationship("PitchRecording", back_populates="kinematics")
 
+# 建立 pitch_record 表 (含 trigram 索引) 之前，先確保 pg_trgm 擴充套件已啟用
+PG_TRGM_EXTENSION_DDL = DDL("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+event.listen(PitchRecording.__table__, 'before_create', PG_TRGM_EXTENSION_DDL)
+
 # 表三：儲存來自 API 的單次分析整合結果
 class PitchAnalyses(Base):
     __tablename__ = "pitch_analyses"
@@ -59,7 +71,7 @@ class PitchAnalyses(Base):
     max_speed_kmh = Column(Float)
     pitch_score = Column(Integer)
     ball_score = Column(Float)
-    biomechanics_features = Column(JSON)
+    biomechanics_features = Column(JSONB)
     release_frame_url = Column(String, index=True)
     landing_frame_url = Column(String, index=True)
     shoulder_frame_url = Column(String, index=True)
@@ -71,7 +83,7 @@ class PitchModel(Base):
     id = Column(Integer, primary_key=True, index=True)
     model_name = Column(String, unique=True, index=True, nullable=False)
     method = Column(String, default='percentile')
-    profile_data = Column(JSON, nullable=False)
+    profile_data = Column(JSONB, nullable=False)
     source_feature_count = Column(Integer)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
@@ -139,15 +151,62 @@ def reset_single_table(model_class):
         print(f"❌ 操作 '{table_name}' 資料表時發生錯誤: {e}")
 
 
+def create_missing_indexes():
+    """
+    為既有的資料表補上模型中新定義的索引 (已存在的索引會略過，不會刪除任何資料)。
+    """
+    try:
+        with engine.begin() as connection:
+            connection.execute(PG_TRGM_EXTENSION_DDL)
+
+        for table in Base.metadata.sorted_tables:
+            for index in table.indexes:
+                print(f"正在檢查索引 '{index.name}'...")
+                index.create(bind=engine, checkfirst=True)
+
+        print("✅ 所有索引皆已建立！")
+    except Exception as e:
+        print(f"❌ 建立索引時發生錯誤: {e}")
+
+
+def migrate_json_columns_to_jsonb():
+    """
+    把既有資料表中的 json 欄位就地轉成 jsonb (保留資料)。
+    jsonb 以二進位格式儲存，讀取時不必重新解析 JSON 文字，也能建立 GIN 索引。
+    """
+    json_columns = [
+        ("pitch_record", "keypoints_data"),
+        ("pitch_analyses", "biomechanics_features"),
+        ("pitch_model", "profile_data"),
+    ]
+    try:
+        with engine.begin() as connection:
+            for table_name, column_name in json_columns:
+                print(f"正在轉換 '{table_name}.{column_name}' 為 jsonb...")
+                connection.execute(text(
+                    f"ALTER TABLE {table_name} ALTER COLUMN {column_name} "
+                    f"TYPE jsonb USING {column_name}::jsonb"
+                ))
+        print("✅ 所有 JSON 欄位皆已轉換為 jsonb！")
+    except Exception as e:
+        print(f"❌ 轉換 JSON 欄位時發生錯誤: {e}")
+
+
 if __name__ == "__main__":
     print("您想要執行哪個操作？")
     print("1. 重置 'pitch_profiles' 資料表 (推薦)")
     print("2. 重置整個資料庫 (危險操作！)")
-    choice = input("請輸入選項 (1/2): ")
+    print("3. 為既有資料表補建索引 (不會刪除資料)")
+    print("4. 將既有的 JSON 欄位轉換為 jsonb (不會刪除資料)")
+    choice = input("請輸入選項 (1/2/3/4): ")
 
     if choice == '1':
         reset_single_table(PitchModel)
     elif choice == '2':
         reset_database()
+    elif choice == '3':
+        create_missing_indexes()
+    elif choice == '4':
+        migrate_json_columns_to_jsonb()
     else:
         print("無效的選項，操作已取消。")
\ No newline at end of file
@@ -1,6 +1,8 @@
 import cv2
 import os
-import math
+import shutil
+import functools
+import subprocess
 import numpy as np
 from typing import Tuple # 導入 Tuple 以正確標註回傳型別
 
@@ -23,16 +25,29 @@ LIMB_COLORS = [
     (255, 0, 255), (255, 0, 255)
 ]
 
+# 預先轉成 ndarray，繪圖時可以一次用遮罩篩出兩端都可信的骨架線
+SKELETON_ARRAY = np.array(SKELETON_CONNECTIONS, dtype=np.int32)
+
+# 依顏色把骨架線分組，每組只需呼叫一次 cv2.polylines
+# (LIMB_COLORS 中同色的線是連續排列的，分組繪製不會改變線條的覆蓋順序)
+LIMB_COLOR_GROUPS = [
+    (color, np.array([i for i, c in enumerate(LIMB_COLORS) if c == color]))
+    for color in dict.fromkeys(LIMB_COLORS)
+]
+
+NUM_KEYPOINTS = 17 # COCO 關節點數量
 KEYPOINT_COLOR = (0, 0, 255) # 關節點顏色
 BBOX_COLOR = (0, 255, 0) # Bounding Box 顏色
 
-def draw_pitcher_on_frame(image, pitcher_data, kpt_thr=0.3, line_thickness=1, point_radius=3):
+def parse_pitcher_data(pitcher_data):
     """
-    在一幀影像上繪製一個投手的骨架和邊界框。
-    """
-    if not pitcher_data:
-        return image
+    解析 API 回傳的單一投手資料。
 
+    Returns:
+        tuple: (bbox, keypoints, keypoint_scores)
+        - bbox: [x1, y1, x2, y2]，格式不正確時為 None
+        - keypoints: np.ndarray (K, 2)、keypoint_scores: np.ndarray (K,)，缺少或格式不正確時皆為 None
+    """
     bbox_data = pitcher_data.get('bbox')
     keypoints_data = pitcher_data.get('keypoints')
     keypoint_scores_data = pitcher_data.get('keypoint_scores')
@@ -45,15 +60,12 @@ def draw_pitcher_on_frame(image, pitcher_data, kpt_thr=0.3, line_thickness=1, po
         bbox_data = bbox_data[0]
     
     bbox = bbox_data
-    
-    # 繪製邊界框 (Bounding Box)
-    if bbox and len(bbox) == 4 and all(isinstance(c, (int, float)) for c in bbox):
-        x1, y1, x2, y2 = [int(coord) for coord in bbox]
-        cv2.rectangle(image, (x1, y1), (x2, y2), BBOX_COLOR, line_thickness)
+    if not (bbox and len(bbox) == 4 and all(isinstance(c, (int, float)) for c in bbox)):
+        bbox = None
 
     # 檢查數據是否存在且非空
     if not keypoints_data or not keypoint_scores_data:
-        return image
+        return bbox, None, None
 
     keypoints = np.array(keypoints_data)
     keypoint_scores = np.array(keypoint_scores_data)
@@ -61,27 +73,280 @@ def draw_pitcher_on_frame(image, pitcher_data, kpt_thr=0.3, line_thickness=1, po
     # 檢查數據維度是否正確
     if keypoints.ndim != 2 or keypoints.shape[1] != 2 or keypoint_scores.ndim != 1:
         print(f"⚠️ 數據格式不正確，無法繪製骨架。Keypoints shape: {keypoints.shape}, Scores shape: {keypoint_scores.shape}")
+        return bbox, None, None
+
+    return bbox, keypoints, keypoint_scores
+
+
+def draw_pitcher_arrays(image, bbox, keypoints, keypoint_scores, kpt_thr=0.3, line_thickness=1, point_radius=3):
+    """
+    在一幀影像上繪製一個投手的骨架和邊界框 (輸入為已解析好的座標陣列)。
+    bbox 為 None 或含 NaN 時不畫邊界框；keypoints / keypoint_scores 為 None 時不畫骨架。
+    """
+    # 繪製邊界框 (Bounding Box)
+    if bbox is not None and not np.isnan(bbox).any():
+        x1, y1, x2, y2 = [int(coord) for coord in bbox]
+        cv2.rectangle(image, (x1, y1), (x2, y2), BBOX_COLOR, line_thickness)
+
+    if keypoints is None or keypoint_scores is None:
         return image
 
-    # 繪製骨架連接線
-    for i, (p1_idx, p2_idx) in enumerate(SKELETON_CONNECTIONS):
-        if p1_idx < len(keypoint_scores) and p2_idx < len(keypoint_scores):
-            if keypoint_scores[p1_idx] > kpt_thr and keypoint_scores[p2_idx] > kpt_thr:
-                pt1 = (int(keypoints[p1_idx][0]), int(keypoints[p1_idx][1]))
-                pt2 = (int(keypoints[p2_idx][0]), int(keypoints[p2_idx][1]))
-                # 線條的粗細由 line_thickness 參數控制
-                cv2.line(image, pt1, pt2, LIMB_COLORS[i], line_thickness)
+    # 一次算出所有可信的關節點，再篩出兩端都可信 (且索引在範圍內) 的骨架線
+    visible = keypoint_scores > kpt_thr
+    edges_in_range = np.all(SKELETON_ARRAY < len(keypoint_scores), axis=1)
+    edge_mask = np.zeros(len(SKELETON_ARRAY), dtype=bool)
+    in_range_edges = SKELETON_ARRAY[edges_in_range]
+    edge_mask[edges_in_range] = visible[in_range_edges[:, 0]] & visible[in_range_edges[:, 1]]
+
+    # 座標一次轉成整數 (與 int() 一樣向零截斷)
+    keypoints_int = keypoints.astype(np.int32)
+
+    # 繪製骨架連接線：同色的線段整批交給 cv2.polylines，在 OpenCV 的 C 程式碼中一次畫完
+    for color, group in LIMB_COLOR_GROUPS:
+        segments = keypoints_int[SKELETON_ARRAY[group[edge_mask[group]]]]
+        if len(segments):
+            # 線條的粗細由 line_thickness 參數控制
+            cv2.polylines(image, list(segments), False, color, line_thickness)
 
     # 繪製關節點
-    for i, kpt in enumerate(keypoints):
-        if i < len(keypoint_scores) and keypoint_scores[i] > kpt_thr:
-            x, y = int(kpt[0]), int(kpt[1])
-            # 點的大小 (半徑) 由 point_radius 參數控制
-            cv2.circle(image, (x, y), point_radius, KEYPOINT_COLOR, -1)
+    num_points = min(len(keypoints_int), len(visible))
+    for x, y in keypoints_int[:num_points][visible[:num_points]].tolist():
+        # 點的大小 (半徑) 由 point_radius 參數控制
+        cv2.circle(image, (x, y), point_radius, KEYPOINT_COLOR, -1)
 
     return image
 
 
+def draw_pitcher_on_frame(image, pitcher_data, kpt_thr=0.3, line_thickness=1, point_radius=3):
+    """
+    在一幀影像上繪製一個投手的骨架和邊界框。
+    """
+    if not pitcher_data:
+        return image
+
+    bbox, keypoints, keypoint_scores = parse_pitcher_data(pitcher_data)
+    return draw_pitcher_arrays(image, bbox, keypoints, keypoint_scores, kpt_thr, line_thickness, point_radius)
+
+
+def build_pose_arrays(pose_json: dict, n_frames: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    把骨架 API 的 frames 一次轉成以幀編號為索引的連續陣列，渲染時直接用幀編號取用，
+    不必逐幀查字典、重新解析 bbox 與轉換 keypoints。N 取影片幀數與最大幀編號兩者的較大值。
+
+    Returns:
+        tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        - has_pitcher (N,)：該幀是否有投手資料
+        - bboxes (N, 4)：邊界框，缺值為 NaN
+        - keypoints (N, 17, 2)：關節點座標
+        - keypoint_scores (N, 17)：關節點分數，缺值為 0 (低於門檻，不會被畫出)
+    """
+    frames = pose_json.get('frames', [])
+    n_frames = max(n_frames, max((f['frame_idx'] + 1 for f in frames), default=0))
+
+    has_pitcher = np.zeros(n_frames, dtype=bool)
+    bboxes = np.full((n_frames, 4), np.nan)
+    keypoints = np.zeros((n_frames, NUM_KEYPOINTS, 2))
+    keypoint_scores = np.zeros((n_frames, NUM_KEYPOINTS))
+
+    for f in frames:
+        frame_idx = f['frame_idx']
+        if frame_idx < 0:
+            continue
+
+        # 同一幀重複出現時以最後一筆為準，先清掉先前寫入的資料
+        predictions = f.get('predictions', [])
+        has_pitcher[frame_idx] = bool(predictions and predictions[0])
+        bboxes[frame_idx] = np.nan
+        keypoint_scores[frame_idx] = 0
+        if not has_pitcher[frame_idx]:
+            continue
+
+        bbox, frame_keypoints, frame_scores = parse_pitcher_data(predictions[0])
+        if bbox is not None:
+            bboxes[frame_idx] = bbox
+        if frame_keypoints is not None:
+            # 只保留 COCO 骨架用得到的前 17 個關節點
+            num_points = min(len(frame_keypoints), len(frame_scores), NUM_KEYPOINTS)
+            keypoints[frame_idx, :num_points] = frame_keypoints[:num_points]
+            keypoint_scores[frame_idx, :num_points] = frame_scores[:num_points]
+
+    return has_pitcher, bboxes, keypoints, keypoint_scores
+
+
+def build_ball_box_array(ball_json: dict, n_frames: int) -> np.ndarray:
+    """
+    把棒球 API 的 results ([frame_idx, box] 列表) 轉成以幀編號為索引的 (N, 4) 陣列，
+    沒有偵測到球的幀整列為 NaN。N 取影片幀數與 results 中最大幀編號兩者的較大值。
+    """
+    results = ball_json.get('results', [])
+    n_frames = max(n_frames, max((frame_idx + 1 for frame_idx, _ in results), default=0))
+
+    ball_boxes = np.full((n_frames, 4), np.nan)
+    for frame_idx, box in results:
+        if box is not None and frame_idx >= 0:
+            ball_boxes[frame_idx] = box
+    return ball_boxes
+
+
+def compute_ball_track(ball_boxes: np.ndarray,
+                       width: int,
+                       height: int,
+                       fps: float,
+                       pixel_to_meter: float,
+                       min_valid_speed_kmh: float,
+                       max_valid_speed_kmh: float) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    一次過濾所有棒球框並計算球速，取代在解碼迴圈中逐幀計算。
+
+    Args:
+        ball_boxes (np.ndarray): (N, 4) 以幀編號為索引的棒球框，缺值為 NaN (見 build_ball_box_array)
+        width (int), height (int): 影片寬高，用來過濾面積過大的框
+        fps (float): 影片幀率
+        pixel_to_meter (float): 像素轉公尺的比例
+        min_valid_speed_kmh (float), max_valid_speed_kmh (float): 有效速度範圍
+
+    Returns:
+        tuple[np.ndarray, np.ndarray, np.ndarray]: 通過過濾的幀編號 (M,)、整數框座標 (M, 4)、
+        以及到該幀為止的最大有效球速 (M,)
+    """
+    # 與逐幀繪圖相同，座標先向零截斷成整數
+    frame_ids = np.flatnonzero(~np.isnan(ball_boxes).any(axis=1))
+    boxes = ball_boxes[frame_ids].astype(np.int64)
+
+    # 長寬比和面積大小過濾，排除不太可能是棒球的框 (寬高需大於 0，避免除以零)
+    w = boxes[:, 2] - boxes[:, 0]
+    h = boxes[:, 3] - boxes[:, 1]
+    area = w * h
+    with np.errstate(divide='ignore', invalid='ignore'):
+        aspect_ratio = w / h
+    mask = ((w > 0) & (h > 0) & (aspect_ratio >= 0.6) & (aspect_ratio <= 1.5)
+            & (area > 10) & (area < width * height * 0.03))
+    frame_ids = frame_ids[mask]
+    boxes = boxes[mask]
+
+    # 相鄰兩個有效框之間的位移 → 球速 (km/h)
+    centers = (boxes[:, :2] + boxes[:, 2:]) // 2
+    dx, dy = np.diff(centers, axis=0).T
+    with np.errstate(divide='ignore', invalid='ignore'):
+        dt = np.diff(frame_ids) / fps
+        speeds = np.hypot(dx, dy) * pixel_to_meter / dt * 3.6
+    valid = (dt > 0) & (speeds >= min_valid_speed_kmh) & (speeds <= max_valid_speed_kmh)
+
+    # 第一個有效框之前沒有速度可算，因此從 0 開始累積最大值
+    max_speeds = np.maximum.accumulate(np.concatenate([[0.0], np.where(valid, speeds, 0.0)]))
+    return frame_ids, boxes, max_speeds[:len(frame_ids)]
+
+
+"""
+最大球速標籤 (HUD)
+"""
+HUD_FONT = cv2.FONT_HERSHEY_SIMPLEX
+
+
+def render_speed_hud(max_speed_kmh: float) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    把「Max Speed」標籤畫成一張小圖與對應的遮罩，只有球速數值改變時才需要重畫。
+    小圖左上角對齊影格原點，遮罩標出標籤實際覆蓋的像素 (包含超出黑底框的文字)，
+    可用 np.copyto(..., where=mask) 直接貼回每一幀。
+    """
+    label = f"Max Speed: {max_speed_kmh:.1f} km/h"
+    (text_width, _), _ = cv2.getTextSize(label, HUD_FONT, 1, 2)
+    hud_width = max(361, 40 + text_width + 10)
+
+    sprite = np.zeros((81, hud_width, 3), dtype=np.uint8)
+    mask = np.zeros((81, hud_width), dtype=np.uint8)
+    cv2.rectangle(sprite, (30, 30), (360, 80), (0, 0, 0), -1)
+    cv2.putText(sprite, label, (40, 65), HUD_FONT, 1, (255, 255, 255), 2)
+    cv2.rectangle(mask, (30, 30), (360, 80), 255, -1)
+    cv2.putText(mask, label, (40, 65), HUD_FONT, 1, 255, 2)
+    return sprite, mask.astype(bool)[..., None]
+
+
+"""
+輸出影片的編碼器
+"""
+# ffmpeg 使用的視訊編碼器，可透過環境變數改成硬體編碼器 (例如 h264_nvenc、h264_videotoolbox)
+FFMPEG_VIDEO_CODEC = os.environ.get("FFMPEG_VIDEO_CODEC", "libx264")
+
+
+class FFmpegEncodeError(RuntimeError):
+    """ffmpeg 子行程無法編碼 (例如缺少編碼器、硬體編碼器無法初始化) 時拋出。"""
+
+
+@functools.lru_cache(maxsize=8)
+def ffmpeg_has_encoder(ffmpeg_path: str, codec: str) -> bool:
+    """
+    以 `ffmpeg -hide_banner -encoders` 檢查此 ffmpeg 是否編譯了指定的編碼器 (結果會快取)。
+    """
+    try:
+        result = subprocess.run([ffmpeg_path, '-hide_banner', '-encoders'],
+                                capture_output=True, text=True, timeout=10)
+    except (OSError, subprocess.SubprocessError):
+        return False
+    if result.returncode != 0:
+        return False
+    # 每行格式為 " V....D libx264  說明..."，第二個欄位是編碼器名稱
+    return any(line.split()[1:2] == [codec] for line in result.stdout.splitlines())
+
+
+class FFmpegVideoWriter:
+    """
+    把影格以 raw BGR 透過 stdin 交給 ffmpeg 子行程編碼，介面與 cv2.VideoWriter 相同 (write / release)。
+    編碼在另一個行程中進行，可以和 Python 端的解碼、繪圖同時執行。
+    """
+
+    def __init__(self, ffmpeg_path: str, output_video_path: str, fps: float, width: int, height: int,
+                 codec: str = FFMPEG_VIDEO_CODEC):
+        command = [
+            ffmpeg_path, '-y', '-loglevel', 'error',
+            '-f', 'rawvideo', '-pix_fmt', 'bgr24', '-s', f'{width}x{height}', '-r', str(fps),
+            '-i', 'pipe:0', '-an',
+            # yuv420p 需要偶數的寬高，奇數時補一行/列像素
+            '-vf', 'pad=ceil(iw/2)*2:ceil(ih/2)*2',
+            '-c:v', codec, '-pix_fmt', 'yuv420p',
+            output_video_path
+        ]
+        self.output_video_path = output_video_path
+        self.process = subprocess.Popen(command, stdin=subprocess.PIPE)
+
+    def write(self, frame: np.ndarray):
+        # frame 是 OpenCV 解出的連續記憶體，直接以 buffer 寫入，不額外複製成 bytes
+        try:
+            self.process.stdin.write(frame.data)
+        except (BrokenPipeError, ValueError) as e:
+            # ffmpeg 已提前結束 (例如編碼器初始化失敗)
+            raise FFmpegEncodeError(f"ffmpeg 編碼影片失敗：{self.output_video_path}") from e
+
+    def release(self):
+        try:
+            self.process.stdin.close()
+        except BrokenPipeError:
+            pass
+        if self.process.wait() != 0:
+            raise FFmpegEncodeError(f"ffmpeg 編碼影片失敗：{self.output_video_path}")
+
+    def abort(self):
+        """中途出錯時結束 ffmpeg 子行程並回收，不檢查編碼結果。"""
+        if self.process.poll() is None:
+            self.process.kill()
+        try:
+            self.process.stdin.close()
+        except BrokenPipeError:
+            pass
+        self.process.wait()
+
+
+def open_video_writer(output_video_path: str, fps: float, width: int, height: int, use_ffmpeg: bool = True):
+    """
+    有安裝 ffmpeg 且支援 FFMPEG_VIDEO_CODEC 時使用 FFmpegVideoWriter (H.264)，
+    否則 (或 use_ffmpeg=False 時) 退回 OpenCV 的 mp4v 軟體編碼。
+    """
+    ffmpeg_path = shutil.which('ffmpeg') if use_ffmpeg else None
+    if ffmpeg_path and ffmpeg_has_encoder(ffmpeg_path, FFMPEG_VIDEO_CODEC):
+        return FFmpegVideoWriter(ffmpeg_path, output_video_path, fps, width, height)
+
+    fourcc = cv2.VideoWriter_fourcc(*'mp4v')
+    return cv2.VideoWriter(output_video_path, fourcc, fps, (width, height))
 
 
 def render_video_with_pose_and_max_ball_speed(input_video_path: str,
@@ -108,6 +373,21 @@ def render_video_with_pose_and_max_ball_speed(input_video_path: str,
     """
     os.makedirs(os.path.dirname(output_video_path), exist_ok=True)
 
+    args = (input_video_path, pose_json, ball_json, output_video_path,
+            pixel_to_meter, min_valid_speed_kmh, max_valid_speed_kmh)
+    try:
+        return _render_video(*args, use_ffmpeg=True)
+    except FFmpegEncodeError as e:
+        # ffmpeg 雖有列出編碼器但實際無法編碼 (例如沒有 GPU 的 h264_nvenc)，改用 OpenCV 重新輸出
+        print(f"⚠️ {e}，改用 OpenCV 編碼。")
+        return _render_video(*args, use_ffmpeg=False)
+
+
+def _render_video(input_video_path, pose_json, ball_json, output_video_path,
+                  pixel_to_meter, min_valid_speed_kmh, max_valid_speed_kmh, use_ffmpeg):
+    """
+    render_video_with_pose_and_max_ball_speed 的實際解碼、繪圖與編碼流程。
+    """
     cap = cv2.VideoCapture(input_video_path)
     if not cap.isOpened():
         raise RuntimeError(f"無法開啟影片：{input_video_path}")
@@ -115,75 +395,74 @@ def render_video_with_pose_and_max_ball_speed(input_video_path: str,
     width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
     height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
     fps = cap.get(cv2.CAP_PROP_FPS)
-    fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-    out = cv2.VideoWriter(output_video_path, fourcc, fps, (width, height))
+    try:
+        out = open_video_writer(output_video_path, fps, width, height, use_ffmpeg)
+    except BaseException:
+        cap.release()
+        raise
     
-    pose_frames = {f['frame_idx']: f.get('predictions', []) for f in pose_json.get('frames', [])}
-    ball_frames = {frame_idx: box for frame_idx, box in ball_json.get('results', [])}
+    # 不論成功或中途出錯都要釋放 cap；出錯時結束並回收 ffmpeg 子行程
+    try:
+        # 骨架與棒球框都先整理成以幀編號為索引的陣列
+        n_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        has_pitcher, pose_bboxes, pose_keypoints, pose_scores = build_pose_arrays(pose_json, n_frames)
+        ball_boxes = build_ball_box_array(ball_json, n_frames)
     
-    prev_center = None
-    prev_frame_idx = None
-    max_speed_kmh = 0
-
-    frame_idx = 0
-    while True:
-        ret, frame = cap.read()
-        if not ret:
-            break
-
-        # 整合進來的繪圖邏輯
-        pose_predictions_for_frame = pose_frames.get(frame_idx, [])
-        if pose_predictions_for_frame:
-            pitcher_data = pose_predictions_for_frame[0]
-            # 直接呼叫本檔案內的繪圖函式
-            draw_pitcher_on_frame(frame, pitcher_data)
+        # 棒球框的過濾與球速計算在解碼前一次完成，迴圈內只需依序取用
+        track_frames, track_boxes, track_max_speeds = compute_ball_track(
+            ball_boxes, width, height, fps, pixel_to_meter, min_valid_speed_kmh, max_valid_speed_kmh
+        )
+        track_frames = track_frames.tolist()
+        track_boxes = track_boxes.tolist()
+        track_max_speeds = track_max_speeds.tolist()
+        track_pos = 0
+        max_speed_kmh = 0
+
+        # 最大球速標籤只在數值改變時重畫，其餘幀直接貼上快取的小圖
+        hud_speed = None
+        hud_sprite = hud_mask = None
+
+        # 預先配置一塊影格緩衝區，讓每次解碼都直接寫回同一塊記憶體，避免逐幀配置新陣列
+        frame = np.empty((height, width, 3), dtype=np.uint8)
+
+        frame_idx = 0
+        while True:
+            ret, frame = cap.read(frame)
+            if not ret:
+                break
+
+            # 整合進來的繪圖邏輯：直接取用預先整理好的骨架陣列
+            if frame_idx < len(has_pitcher) and has_pitcher[frame_idx]:
+                draw_pitcher_arrays(frame, pose_bboxes[frame_idx], pose_keypoints[frame_idx], pose_scores[frame_idx])
         
-        # 畫棒球 + 計算速度
-        if frame_idx in ball_frames:
-            current_ball_box = ball_frames[frame_idx]
-            if current_ball_box is not None:
-                x1, y1, x2, y2 = map(int, current_ball_box)
-                w = x2 - x1
-                h = y2 - y1
-
-                # 檢查寬高是否大於0，避免除以零的錯誤
-                if w > 0 and h > 0:
-                    aspect_ratio = w / h
-                    area = w * h
-                    
-                    # 新增過濾條件：長寬比和面積大小，過濾掉不太可能是棒球的框
-                    # 這些值可能需要根據實際情況微調
-                    if 0.6 <= aspect_ratio <= 1.5 and 10 < area < (width * height * 0.03):      
-                        cx = (x1 + x2) // 2
-                        cy = (y1 + y2) // 2
-                        cv2.rectangle(frame, (x1, y1), (x2, y2), (0, 0, 255), 2)
-                        cv2.putText(frame, "Baseball", (x1, y1 - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 0, 255), 2)
-
-                        if prev_center is not None and prev_frame_idx is not None:
-                            dx = cx - prev_center[0]
-                            dy = cy - prev_center[1]
-                            distance_pixels = math.sqrt(dx**2 + dy**2)
-                            dt = (frame_idx - prev_frame_idx) / fps
-
-                            if dt > 0:
-                                distance_m = distance_pixels * pixel_to_meter
-                                speed_mps = distance_m / dt
-                                speed_kmh = speed_mps * 3.6
-
-                                if min_valid_speed_kmh <= speed_kmh <= max_valid_speed_kmh:
-                                    max_speed_kmh = max(max_speed_kmh, speed_kmh)
-
-                        prev_center = (cx, cy)
-                        prev_frame_idx = frame_idx
-
-        # --- 畫最大球速 (保持不變) ---
-        label = f"Max Speed: {max_speed_kmh:.1f} km/h"
-        cv2.rectangle(frame, (30, 30), (360, 80), (0, 0, 0), -1)
-        cv2.putText(frame, label, (40, 65), cv2.FONT_HERSHEY_SIMPLEX, 1, (255, 255, 255), 2)
-
-        out.write(frame)
-        frame_idx += 1
-
-    cap.release()
+            # 畫棒球 + 更新到目前為止的最大球速
+            if track_pos < len(track_frames) and track_frames[track_pos] == frame_idx:
+                x1, y1, x2, y2 = track_boxes[track_pos]
+                cv2.rectangle(frame, (x1, y1), (x2, y2), (0, 0, 255), 2)
+                cv2.putText(frame, "Baseball", (x1, y1 - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 0, 255), 2)
+                max_speed_kmh = track_max_speeds[track_pos]
+                track_pos += 1
+
+            # --- 畫最大球速 ---
+            if max_speed_kmh != hud_speed:
+                hud_sprite, hud_mask = render_speed_hud(max_speed_kmh)
+                # 影片比標籤小時，裁切到影格範圍內
+                hud_sprite = hud_sprite[:height, :width]
+                hud_mask = hud_mask[:height, :width]
+                hud_speed = max_speed_kmh
+            hud_height, hud_width = hud_mask.shape[:2]
+            np.copyto(frame[:hud_height, :hud_width], hud_sprite, where=hud_mask)
+
+            out.write(frame)
+            frame_idx += 1
+    except BaseException:
+        if isinstance(out, FFmpegVideoWriter):
+            out.abort()
+        else:
+            out.release()
+        raise
+    finally:
+        cap.release()
+
     out.release()
     return output_video_path, max_speed_kmh
\ No newline at end of file
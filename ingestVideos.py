@@ -4,6 +4,7 @@ import os
 import pandas as pd
 import httpx
 from typing import Dict, Optional, Tuple
+from sqlalchemy import insert
 
 # 從我們新的「資料庫中心」匯入所有需要的東西
 try:
@@ -20,35 +21,33 @@ except ImportError:
     exit()
 
 
-def analyze_video_and_get_features(video_path: str, pose_api_url: str) -> Optional[Tuple[Dict, Dict]]:
+def analyze_video_and_get_features(video_path: str, pose_api_url: str, client: httpx.Client) -> Optional[Tuple[Dict, Dict]]:
     """
     分析單一影片檔案，呼叫 Pose API，並回傳 (原始pose_data, 計算後的features) 的元組。
+    client 由呼叫端建立並在整批影片間共用，避免每支影片都重新建立連線。
     """
     if not os.path.exists(video_path):
         print(f"  ❌ 錯誤：找不到影片檔案 {video_path}")
         return None, None
 
     try:
-        # 讀取影片檔案
+        # 使用共用的同步 httpx.Client 進行 API 請求
+        # 直接把檔案物件交給 httpx，由它分塊讀取並上傳，不必先把整支影片讀進記憶體
         with open(video_path, "rb") as f:
-            video_bytes = f.read()
-
-        # 使用同步的 httpx.Client 進行 API 請求
-        with httpx.Client(timeout=300.0) as client:
-            files = {"file": (os.path.basename(video_path), video_bytes, "video/mp4")}
+            files = {"file": (os.path.basename(video_path), f, "video/mp4")}
             print(f"  ... 正在呼叫 Pose API: {pose_api_url}")
             response = client.post(pose_api_url, files=files)
-            response.raise_for_status() 
-            
-            pose_data = response.json()
-            features = extract_pitching_biomechanics(pose_data)
-            
-            # 驗證特徵，確保所有值都不是 None
-            if features and all(value is not None for value in features.values()):
-                return pose_data, features 
-            else:
-                print(f"  ⚠️ 從 API 回應中無法提取有效特徵。特徵值: {features}")
-                return None, None
+        response.raise_for_status() 
+        
+        pose_data = response.json()
+        features = extract_pitching_biomechanics(pose_data)
+        
+        # 驗證特徵，確保所有值都不是 None
+        if features and all(value is not None for value in features.values()):
+            return pose_data, features 
+        else:
+            print(f"  ⚠️ 從 API 回應中無法提取有效特徵。特徵值: {features}")
+            return None, None
 
     except httpx.RequestError as e:
         print(f"  ❌ 網路錯誤：無法連接到 Pose API {e.request.url}。請確認 API 服務正在運行。")
@@ -60,6 +59,29 @@ def analyze_video_and_get_features(video_path: str, pose_api_url: str) -> Option
     return None, None
 
 
+def save_pending_batch(db, pending_records: list, pending_kinematics: list):
+    """
+    一次寫入累積的 pitch_record 與 kinematics 資料 (皆為欄位字典)，整批只 commit 一次。
+    pitch_record 以批次 INSERT ... RETURNING id 寫入，再把 id 依序填回對應的 kinematics，
+    最後以一次 executemany 寫入 kinematics，不建立 ORM 物件也不逐筆往返資料庫。
+    """
+    if not pending_records:
+        return
+
+    record_ids = db.scalars(
+        insert(PitchRecording).returning(PitchRecording.id, sort_by_parameter_order=True),
+        pending_records
+    ).all()
+    for kinematics_row, record_id in zip(pending_kinematics, record_ids):
+        kinematics_row['pitch_record_id'] = record_id
+    db.execute(insert(Kinematics), pending_kinematics)
+    db.commit()
+
+    print(f"  💾 已將 {len(pending_records)} 筆新紀錄與特徵寫入資料庫。")
+    pending_records.clear()
+    pending_kinematics.clear()
+
+
 if __name__ == "__main__":
     # --- 1. 參數設定 ---
     # 這裡集中了所有您可以修改的參數
@@ -71,6 +93,9 @@ if __name__ == "__main__":
     
     # 設定本次最多處理幾筆「新」影片 (設定為 None 則不限制)
     MAX_VIDEOS_TO_PROCESS = None
+
+    # 每累積幾筆新資料才寫入並 commit 一次 (減少每支影片兩次 commit 的往返)
+    COMMIT_BATCH_SIZE = 32
     
     # --- 程式會自動組合出完整路徑 ---
     DATA_DIRECTORY = os.path.join("..", DATA_ROOT_FOLDER, PITCHER_FOLDER_NAME)
@@ -91,10 +116,14 @@ if __name__ == "__main__":
 
     # --- 3. 遍歷、檢查、分析、儲存 ---
     db = SessionLocal()
+    # 整批影片共用同一個 HTTP 連線池 (keep-alive)，不必每支影片都重新建立 TCP 連線
+    http_client = httpx.Client(timeout=300.0, limits=httpx.Limits(max_connections=8))
     try:
         all_videos_in_folder = [f for f in os.listdir(DATA_DIRECTORY) if f.lower().endswith(('.mp4', '.mov', '.avi'))]
         total_videos = len(all_videos_in_folder)
         new_records_count = 0
+        pending_records = []
+        pending_kinematics = []
 
         for i, video_name in enumerate(all_videos_in_folder):
             print(f"\n[{i+1}/{total_videos}] 正在檢查影片: {video_name}")
@@ -111,13 +140,13 @@ if __name__ == "__main__":
                 continue
 
             # 分析影片
-            pose_data, features = analyze_video_and_get_features(os.path.join(DATA_DIRECTORY, video_name), POSE_API_URL)
+            pose_data, features = analyze_video_and_get_features(os.path.join(DATA_DIRECTORY, video_name), POSE_API_URL, http_client)
             
             if pose_data and features:
                 video_info = metadata_map.get(video_name, {})
 
                 # 步驟 A: 儲存「原始紀錄」到 pitch_record 表
-                new_pitch_record = PitchRecording(
+                new_pitch_record = dict(
                     player_name=video_info.get('player_name'),
                     pitch_type=video_info.get('pitch_type'),
                     video_filename=video_name,
@@ -125,13 +154,9 @@ if __name__ == "__main__":
                     source_csv=CSV_FILENAME,
                     keypoints_data=pose_data
                 )
-                db.add(new_pitch_record)
-                db.commit()
-                db.refresh(new_pitch_record)
 
-                # 步驟 B: 儲存「運動學特徵」到 kinematics 表，並關聯
-                new_kinematics_obj = Kinematics(
-                    pitch_record_id=new_pitch_record.id,
+                # 步驟 B: 儲存「運動學特徵」到 kinematics 表 (pitch_record_id 於批次寫入時再填入)
+                new_kinematics_row = dict(
                     trunk_flexion_excursion=features.get('Trunk_flexion_excursion'),
                     pelvis_obliquity_at_fc=features.get('Pelvis_obliquity_at_FC'),
                     trunk_rotation_at_br=features.get('Trunk_rotation_at_BR'),
@@ -143,18 +168,25 @@ if __name__ == "__main__":
                     shoulder_frame=features.get('shoulder_frame'),
                     total_frames=features.get('total_frames')
                 )
-                db.add(new_kinematics_obj)
-                db.commit()
+                pending_records.append(new_pitch_record)
+                pending_kinematics.append(new_kinematics_row)
                 
                 new_records_count += 1
-                print(f"  ✅ 新紀錄與特徵已成功存入資料庫。")
+                print(f"  ✅ 新紀錄與特徵已加入待寫入批次。")
+
+                if len(pending_records) >= COMMIT_BATCH_SIZE:
+                    save_pending_batch(db, pending_records, pending_kinematics)
             else:
                 print(f"  ❌ 分析失敗或未提取到有效特徵，已跳過。")
 
+        # 寫入最後一批不足 COMMIT_BATCH_SIZE 的資料
+        save_pending_batch(db, pending_records, pending_kinematics)
+
     except Exception as e:
         print(f"\n處理過程中發生嚴重錯誤: {e}")
         db.rollback()
     finally:
+        http_client.close()
         db.close()
 
     print("\n========================================================")
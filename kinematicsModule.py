@@ -7,14 +7,14 @@ import cv2
 """
 落地那一幀
 """
-def detect_landing_frame(pose_sequence, release_frame, back_offset=9):
+def detect_landing_frame(pa, release_frame, back_offset=9):
     """
     根據 release_frame 向前推 back_offset 幀作為落地點
-    - pose_sequence: 骨架序列（list of dict，含 frame 與 keypoints）
+    - pa: PoseArray，整段骨架序列
     - release_frame: 偵測出的出手幀編號
     - back_offset: 預設往前 9 幀
     """
-    candidate_index = next((i for i, item in enumerate(pose_sequence) if item["frame"] == release_frame), None)
+    candidate_index = pa.idx.get(release_frame)
     if candidate_index is None:
         print(f"❌ 找不到 release_frame = {release_frame} 的對應資料")
         return None
@@ -24,8 +24,7 @@ def detect_landing_frame(pose_sequence, release_frame, back_offset=9):
         print(f"❌ 推估 index = {landing_index} 超出範圍")
         return None
 
-    landing_item = pose_sequence[landing_index]
-    landing_frame = landing_item["frame"]
+    landing_frame = int(pa.frames[landing_index])
 
     return landing_frame
 
@@ -33,111 +32,88 @@ def detect_landing_frame(pose_sequence, release_frame, back_offset=9):
 """
 出手那一幀
 """
-def detect_release_frame(pose_sequence):
-    candidate_frames = []
-
-    for item in pose_sequence:
-        frame_idx = item["frame"]
-        keypoints = item["keypoints"]
-        if keypoints.shape[0] < 17:
-            continue
-
-        rs = COCO_KEYPOINTS["right_shoulder"]
-        re = COCO_KEYPOINTS["right_elbow"]
-        rw = COCO_KEYPOINTS["right_wrist"]
-
-        right_shoulder = keypoints[rs]
-        right_elbow = keypoints[re]
-        right_wrist = keypoints[rw]
-
-        # 1. 手腕高於肩膀（Y 軸）
-        wrist_above_shoulder = right_wrist[1] < right_shoulder[1]
-        # 2. 手肘在手腕後方（X 軸）
-        elbow_behind_wrist = right_elbow[0] < right_wrist[0]
-        # 3. 肘角
-        elbow_angle = calculate_pixel_angle_from_points(
-            right_wrist[:2], right_elbow[:2], right_shoulder[:2]
-        )
-        # 4. 手臂長度（wrist→elbow + elbow→shoulder）
-        arm_length = np.linalg.norm(right_wrist - right_elbow) + np.linalg.norm(right_elbow - right_shoulder)
+def detect_release_frame(pa):
+    """
+    偵測出手幀（所有幀一次向量化計算）：
+    - pa: PoseArray，整段骨架序列
+    - 條件：右手腕高於右肩、右手肘在右手腕後方
+    - 評分：先挑肘角最大，再用臂長決勝負（肘角差距容忍 5 度內）
+
+    return: release_frame 編號（int）或 None
+    """
+    rs = pa.kps[:, RS]
+    re = pa.kps[:, RE]
+    rw = pa.kps[:, RW]
 
-        if wrist_above_shoulder and elbow_behind_wrist:
-            candidate_frames.append({
-                "frame": frame_idx,
-                "elbow_angle": elbow_angle,
-                "arm_length": arm_length
-            })
+    # 1. 手腕高於肩膀（Y 軸）
+    wrist_above_shoulder = rw[:, 1] < rs[:, 1]
+    # 2. 手肘在手腕後方（X 軸）
+    elbow_behind_wrist = re[:, 0] < rw[:, 0]
+    candidates = np.flatnonzero(wrist_above_shoulder & elbow_behind_wrist)
 
-    if not candidate_frames:
+    if candidates.size == 0:
         print("⚠️ 沒有符合條件的出手幀")
         return None
 
+    # 只對候選幀計算肘角與臂長，不必為整段序列配置暫存陣列
+    rs, re, rw = rs[candidates], re[candidates], rw[candidates]
+    # 3. 肘角
+    elbow_angle = calculate_pixel_angle(rw[:, :2], re[:, :2], rs[:, :2])
+    # 4. 手臂長度（wrist→elbow + elbow→shoulder）
+    arm_length = np.linalg.norm(rw - re, axis=1) + np.linalg.norm(re - rs, axis=1)
+
     # 🔍 先挑肘角最大，再用臂長決勝負（肘角差距容忍 5 度內）
-    max_angle = max(f["elbow_angle"] for f in candidate_frames)
-    top_angle_candidates = [f for f in candidate_frames if abs(f["elbow_angle"] - max_angle) < 5]
-    best_frame = max(top_angle_candidates, key=lambda f: f["arm_length"])
+    top_angle_candidates = np.abs(elbow_angle - elbow_angle.max()) < 5
+    best = np.argmax(np.where(top_angle_candidates, arm_length, -np.inf))
 
-    return best_frame["frame"]
+    return int(pa.frames[candidates[best]])
 
 # shoulder.py
 """
 肩膀最大那一幀
 """
-def detect_shoulder_frame(pose_sequence, release_frame):
+def detect_shoulder_frame(pa, release_frame):
     """
     偵測肩膀最開啟的幀：
     - 起始：右手腕高於右肩（代表投球已啟動）
     - 條件：右手腕仍在右肩左側且未落下
     - 評分：肩寬前 3 名 → 選最大肩角
 
+    pa: PoseArray，只取出手幀之前的幀一次向量化計算。
     return: shoulder_frame 編號（int）或 None
     """
-    candidate_list = []
-    start_found = False
-
-    LEFT_SHOULDER = COCO_KEYPOINTS["left_shoulder"]
-    RIGHT_SHOULDER = COCO_KEYPOINTS["right_shoulder"]
-    LEFT_HIP = COCO_KEYPOINTS["left_hip"]
-    RIGHT_WRIST = COCO_KEYPOINTS["right_wrist"]
-
-    for item in pose_sequence:
-        frame_idx = item["frame"]
-        if frame_idx > release_frame:
-            break
-
-        keypoints = item["keypoints"]
-        if np.min(keypoints[[LEFT_SHOULDER, RIGHT_SHOULDER, LEFT_HIP, RIGHT_WRIST], 2]) < 0.3:
-            continue
-
-        l_sh = keypoints[LEFT_SHOULDER][:2]
-        r_sh = keypoints[RIGHT_SHOULDER][:2]
-        l_hip = keypoints[LEFT_HIP][:2]
-        r_wr = keypoints[RIGHT_WRIST][:2]
-
-        # 起始條件：右手腕高於右肩
-        if not start_found:
-            if r_wr[1] < r_sh[1]:
-                start_found = True
-            else:
-                continue
-
-        # 排除：右手腕落下 或 手腕已超過肩膀
-        if r_wr[0] > r_sh[0] or r_wr[1] >= r_sh[1]:
-            continue
-
-        # 肩膀開啟角度（l_sh - r_sh - l_hip）
-        angle = calculate_pixel_angle_from_points(l_sh, r_sh, l_hip)
-        shoulder_distance = abs(r_sh[0] - l_sh[0])
-        candidate_list.append((angle, shoulder_distance, frame_idx))
-
-    if not candidate_list:
+    # 只看第一個超過 release_frame 的幀之前的部分
+    past_release = pa.frames > release_frame
+    end = int(np.argmax(past_release)) if past_release.any() else len(pa)
+    kp = pa.kps[:end]
+
+    l_sh = kp[:, LS, :2]
+    r_sh = kp[:, RS, :2]
+    l_hip = kp[:, LH, :2]
+    r_wr = kp[:, RW, :2]
+
+    # 信心值不足的幀直接略過（也不能觸發起始條件）
+    conf_ok = pa.joint_valid[:end][:, [LS, RS, LH, RW]].all(axis=1)
+
+    # 起始條件：右手腕高於右肩，一旦成立之後的幀都算已啟動
+    start_found = np.logical_or.accumulate(conf_ok & (r_wr[:, 1] < r_sh[:, 1]))
+
+    # 排除：右手腕落下 或 手腕已超過肩膀
+    excluded = (r_wr[:, 0] > r_sh[:, 0]) | (r_wr[:, 1] >= r_sh[:, 1])
+
+    candidates = np.flatnonzero(conf_ok & start_found & ~excluded)
+    if candidates.size == 0:
         print("❌ 無法找到符合條件的肩膀開啟幀")
         return None
 
+    # 肩膀開啟角度（l_sh - r_sh - l_hip）與肩膀 X 軸距離
+    angle = calculate_pixel_angle(l_sh[candidates], r_sh[candidates], l_hip[candidates])
+    shoulder_distance = np.abs(r_sh[candidates, 0] - l_sh[candidates, 0])
+
     # 取肩膀 X 軸距離最大的前三名 → 選角度最大者
-    top3 = sorted(candidate_list, key=lambda x: -x[1])[:3]
-    best = max(top3, key=lambda x: x[0])
-    shoulder_frame = best[2]
+    top3 = np.argsort(-shoulder_distance, kind="stable")[:3]
+    best = top3[np.argmax(angle[top3])]
+    shoulder_frame = int(pa.frames[candidates[best]])
 
     return shoulder_frame
 
@@ -164,13 +140,25 @@ COCO_KEYPOINTS = {
     "right_ankle": 16,
 }
 
+# 常用關節的索引直接定義成模組常數，計算時不必再查字典
+NOSE = COCO_KEYPOINTS["nose"]
+LS, RS = COCO_KEYPOINTS["left_shoulder"], COCO_KEYPOINTS["right_shoulder"]
+LE, RE = COCO_KEYPOINTS["left_elbow"], COCO_KEYPOINTS["right_elbow"]
+LW, RW = COCO_KEYPOINTS["left_wrist"], COCO_KEYPOINTS["right_wrist"]
+LH, RH = COCO_KEYPOINTS["left_hip"], COCO_KEYPOINTS["right_hip"]
+LK, RK = COCO_KEYPOINTS["left_knee"], COCO_KEYPOINTS["right_knee"]
+LA, RA = COCO_KEYPOINTS["left_ankle"], COCO_KEYPOINTS["right_ankle"]
+
+# 關節信心值門檻，低於此值的關節視為不可靠
+CONF_THRESHOLD = 0.3
+
 
-def feature2kinematic(pose_sequence, release_frame, landing_frame, shoulder_frame=None):
+def feature2kinematic(pa, release_frame, landing_frame, shoulder_frame=None):
     """
     從姿勢序列與關鍵幀中提取基本 2D 力學特徵
 
     輸入：
-        pose_sequence: list of {"frame": int, "keypoints": np.ndarray(17, 3)}
+        pa: PoseArray，整段骨架序列
         release_frame: 出手幀編號
         landing_frame: 踏地幀編號
         shoulder_frame: 肩膀展開幀（暫未使用，可預留）
@@ -185,98 +173,89 @@ def feature2kinematic(pose_sequence, release_frame, landing_frame, shoulder_fram
         - Trunk_lateral_flexion_at_HS
     """
     kinematic = {}
+    kps = pa.kps
+
+    # 肩膀中心與髖部中心 (N, 2) 只算一次，下面各項特徵共用
+    shoulder_ctr = 0.5 * (kps[:, LS, :2] + kps[:, RS, :2])
+    hip_ctr = 0.5 * (kps[:, LH, :2] + kps[:, RH, :2])
+    trunk_y = shoulder_ctr[:, 1] - hip_ctr[:, 1]
 
     # === Trunk flexion excursion（軀幹前彎動作幅度）===
     # 透過每幀的肩膀中心 Y 與髖部中心 Y 的差值，計算最大與最小值差，代表整體前傾變化範圍
-    trunk_flexions = []
-    for item in pose_sequence:
-        keypoints = item["keypoints"]
-        ls, rs = COCO_KEYPOINTS["left_shoulder"], COCO_KEYPOINTS["right_shoulder"]
-        lh, rh = COCO_KEYPOINTS["left_hip"], COCO_KEYPOINTS["right_hip"]
-        shoulder_y = (keypoints[ls][1] + keypoints[rs][1]) / 2
-        hip_y = (keypoints[lh][1] + keypoints[rh][1]) / 2
-        trunk_flexions.append(shoulder_y - hip_y)
-    kinematic["Trunk_flexion_excursion"] = max(trunk_flexions) - min(trunk_flexions)
+    kinematic["Trunk_flexion_excursion"] = float(np.ptp(trunk_y))
 
     # === Pelvis obliquity at FC（踏地瞬間的骨盆傾斜角）===
     # 用左髖與右髖的 Y 值差代表骨盆左右傾斜，Y 差越大表示傾斜越明顯
-    keypoints_fc = get_keypoints_at(pose_sequence, landing_frame)
-    if keypoints_fc is not None:
-        lh, rh = COCO_KEYPOINTS["left_hip"], COCO_KEYPOINTS["right_hip"]
-        pelvis_obliquity = keypoints_fc[lh][1] - keypoints_fc[rh][1]
-        kinematic["Pelvis_obliquity_at_FC"] = pelvis_obliquity
+    fc_i = pa.idx.get(landing_frame)
+    if fc_i is not None:
+        kinematic["Pelvis_obliquity_at_FC"] = float(kps[fc_i, LH, 1] - kps[fc_i, RH, 1])
 
     # === Trunk rotation at BR（釋球瞬間的軀幹旋轉角）===
     # 取左右肩的 X 向量差並轉為角度，表示橫向旋轉程度（水平旋轉角）
-    keypoints_br = get_keypoints_at(pose_sequence, release_frame)
-    if keypoints_br is not None:
-        ls, rs = COCO_KEYPOINTS["left_shoulder"], COCO_KEYPOINTS["right_shoulder"]
-        shoulder_vec = keypoints_br[ls][:2] - keypoints_br[rs][:2]
+    br_i = pa.idx.get(release_frame)
+    if br_i is not None:
+        keypoints_br = kps[br_i]
+        shoulder_vec = keypoints_br[LS, :2] - keypoints_br[RS, :2]
         trunk_rotation = np.arctan2(shoulder_vec[1], shoulder_vec[0]) * 180 / np.pi
-        kinematic["Trunk_rotation_at_BR"] = trunk_rotation
+        kinematic["Trunk_rotation_at_BR"] = float(trunk_rotation)
 
         # === Shoulder abduction at BR（肩部外展角）===
         # 以「右手腕–右手肘–右肩膀」三點形成的角度表示肩膀抬起程度（右投）
-        re = COCO_KEYPOINTS["right_elbow"]
-        rw = COCO_KEYPOINTS["right_wrist"]
-        rs = COCO_KEYPOINTS["right_shoulder"]
-        shoulder_abduction = calculate_pixel_angle_from_points(
-            keypoints_br[rw][:2], keypoints_br[re][:2], keypoints_br[rs][:2]
+        shoulder_abduction = calculate_pixel_angle(
+            keypoints_br[RW, :2], keypoints_br[RE, :2], keypoints_br[RS, :2]
         )
-        kinematic["Shoulder_abduction_at_BR"] = shoulder_abduction
+        kinematic["Shoulder_abduction_at_BR"] = float(shoulder_abduction)
 
         # === Trunk flexion at BR（釋球瞬間的軀幹前傾角）===
         # 釋球幀的肩膀中心 Y 與骨盆中心 Y 差值，數值越大表示向前傾越多
-        lh, rh = COCO_KEYPOINTS["left_hip"], COCO_KEYPOINTS["right_hip"]
-        shoulder_y = (keypoints_br[ls][1] + keypoints_br[rs][1]) / 2
-        hip_y = (keypoints_br[lh][1] + keypoints_br[rh][1]) / 2
-        kinematic["Trunk_flexion_at_BR"] = shoulder_y - hip_y
+        kinematic["Trunk_flexion_at_BR"] = float(trunk_y[br_i])
 
     # === Trunk lateral flexion at HS（起投瞬間的軀幹側彎角）===
     # 起投幀左右肩膀的 Y 軸差異，表示是否側向一側（正值：左肩低於右肩）
-    keypoints_hs = get_keypoints_at(pose_sequence, pose_sequence[0]["frame"])
-    if keypoints_hs is not None:
-        ls, rs = COCO_KEYPOINTS["left_shoulder"], COCO_KEYPOINTS["right_shoulder"]
-        kinematic["Trunk_lateral_flexion_at_HS"] = keypoints_hs[ls][1] - keypoints_hs[rs][1]
+    # 起投幀即序列中的第一幀，直接取 kps[0]
+    kinematic["Trunk_lateral_flexion_at_HS"] = float(kps[0, LS, 1] - kps[0, RS, 1])
 
     return kinematic
 
 def extract_pitching_biomechanics(result):
     """
-    接收已處理好的 pose_sequence，偵測出手、落地、肩膀展開幀。
+    接收 Pose API 回傳的 JSON，偵測出手、落地、肩膀展開幀並計算特徵。
     Args:
-        pose_sequence: list[dict]，每個元素為 {"frame": int, "keypoints": np.ndarray(17, 3)}
+        result: Pose API 回傳的 dict（見 load_pose_from_response）
 
     Returns:
         dict: 包含 release、landing、shoulder 三幀與總長度
     """
 
-    # ✅ 先手動轉成 pose_sequence
-    pose_sequence = load_pose_from_response(result)
+    # ✅ 先一次轉成 (N, 17, 3) 的 keypoints 陣列與幀編號
+    kps, frames = load_pose_from_response(result)
     
-    if not pose_sequence:
+    if len(frames) == 0:
         print("❌ pose_sequence 為空")
         return {}
 
+    # 之後所有偵測與特徵計算共用同一份 PoseArray
+    pa = PoseArray(kps, frames)
+
     # === 出手幀 ===
-    release_frame = detect_release_frame(pose_sequence)
+    release_frame = detect_release_frame(pa)
     if release_frame is None:
         print("❌ 偵測不到出手幀")
         return {}
 
     # === 落地幀 ===
-    landing_frame = detect_landing_frame(pose_sequence, release_frame)
+    landing_frame = detect_landing_frame(pa, release_frame)
 
     # === 肩膀最展開幀 ===
-    shoulder_frame = detect_shoulder_frame(pose_sequence, release_frame)
+    shoulder_frame = detect_shoulder_frame(pa, release_frame)
 
-    kinematic = feature2kinematic(pose_sequence, release_frame, landing_frame)
+    kinematic = feature2kinematic(pa, release_frame, landing_frame)
 
     return {
     "release_frame": release_frame,
     "landing_frame": landing_frame,
     "shoulder_frame": shoulder_frame,
-    "total_frames": len(pose_sequence),
+    "total_frames": len(pa),
     "Trunk_flexion_excursion": kinematic.get("Trunk_flexion_excursion"),
     "Pelvis_obliquity_at_FC": kinematic.get("Pelvis_obliquity_at_FC"),
     "Trunk_rotation_at_BR": kinematic.get("Trunk_rotation_at_BR"),
@@ -288,65 +267,89 @@ def extract_pitching_biomechanics(result):
 
 # utils.py
 """
-通用函式：讀取 pose_sequence、計算角度等
+通用函式：讀取骨架序列、計算角度等
 """
 def load_pose_from_response(result_json):
     """
-    從 FastAPI 回傳的 JSON 解析出 pose_sequence 格式
+    從 FastAPI 回傳的 JSON 解析出整段骨架陣列
     - result_json: API 回傳的 dict
-    - 回傳: list[{"frame": int, "keypoints": np.ndarray(17, 3)}]
+    - 回傳: (kps, frames)
+        kps: np.ndarray(N, 17, 3)，float32，所有有偵測到人的幀的 keypoints
+        frames: np.ndarray(N,)，每一列對應的幀編號
     """
-    pose_sequence = []
+    valid = [frame for frame in result_json["frames"] if frame["predictions"]]
+    frames = np.fromiter((frame["frame_idx"] for frame in valid), dtype=np.int64, count=len(valid))
+    raw = [frame["predictions"][0]["keypoints"] for frame in valid]  # 每幀 shape: (17, 2 or 3)
 
-    for frame in result_json["frames"]:
-        if not frame["predictions"]:
-            continue
+    if not raw:
+        return np.empty((0, 17, 3), dtype=np.float32), frames
 
-        keypoints = np.array(frame["predictions"][0]["keypoints"])  # shape: (17, 2 or 3)
+    try:
+        # 所有幀一次轉成 (N, 17, 2 or 3) 的 float32 陣列，不必逐幀建立小陣列
+        kps = np.asarray(raw, dtype=np.float32)
+    except ValueError:
+        # 各幀欄數不一致 (有的含信心值、有的沒有) 時才逐幀補齊後再疊
+        kps = np.stack([_with_confidence(np.asarray(keypoints, dtype=np.float32)) for keypoints in raw])
 
-        if keypoints.shape[1] == 2:
-            conf = np.ones((17, 1), dtype=np.float32)
-            keypoints = np.concatenate([keypoints, conf], axis=-1)
+    return np.ascontiguousarray(_with_confidence(kps)), frames
 
-        pose_sequence.append({
-            "frame": frame["frame_idx"],
-            "keypoints": keypoints
-        })
 
-    return pose_sequence
+def _with_confidence(keypoints):
+    """
+    keypoints 只有 (x, y) 兩欄時補上信心值 1.0，變成 (x, y, conf)。
+    """
+    if keypoints.shape[-1] == 2:
+        conf = np.ones(keypoints.shape[:-1] + (1,), dtype=np.float32)
+        keypoints = np.concatenate([keypoints, conf], axis=-1)
+    return keypoints
 
 
-def get_keypoints_at(pose_sequence, frame_id):
+def build_frame_index(frames):
+    """
+    建立幀編號 → 陣列索引的對照表，取代每次查詢都線性掃描整個序列。
+    同一幀編號重複出現時以第一次出現的位置為準。
     """
-    根據幀編號 frame_id 回傳該幀的 keypoints。
-    - pose_sequence: list of dict，格式為 [{"frame": int, "keypoints": np.ndarray(17, 3)}]
-    - frame_id: int，欲查找的幀號
+    frame_index = {}
+    for i, frame_id in enumerate(frames.tolist()):
+        frame_index.setdefault(frame_id, i)
+    return frame_index
+
 
-    回傳：該幀的 keypoints，或 None 若找不到。
+class PoseArray:
     """
-    for item in pose_sequence:
-        if item["frame"] == frame_id:
-            return item["keypoints"]
-    return None
+    整段骨架序列 (N, 17, 3) 的連續陣列與幀編號 → 索引對照表，
+    建立一次後由所有偵測函式與 feature2kinematic 共用。
+    - kps: np.ndarray(N, 17, 3)，所有幀的 keypoints
+    - frames: np.ndarray(N,)，每一列對應的幀編號
+    - idx: dict，幀編號 → kps 索引（見 build_frame_index）
+    - joint_valid: np.ndarray(N, 17) bool，各關節信心值是否達 CONF_THRESHOLD
+    """
+
+    def __init__(self, kps, frames):
+        self.kps = np.ascontiguousarray(kps, dtype=np.float32)
+        self.frames = frames
+        self.idx = build_frame_index(frames)
+        self.joint_valid = self.kps[:, :, 2] >= CONF_THRESHOLD
+
+    def __len__(self):
+        return len(self.frames)
 
 
 def calculate_pixel_angle(a, b, c):
     """
     計算以點 b 為中心，夾在向量 ab 和 cb 之間的夾角（像素座標）
-    - a, b, c: np.array([x, y])
-    - 回傳: angle in degrees
+    - a, b, c: np.array([x, y])，也可傳入 (N, 2) 陣列一次計算 N 個角度
+    - 回傳: angle in degrees（任一向量長度為 0 時回傳 0）
+
+    以 atan2(|ab × cb|, ab · cb) 計算，不需除以向量長度也不必 clip，
+    在兩向量接近平行 / 反向時比 arccos 穩定。
     """
     ab = a - b
     cb = c - b
 
-    norm_ab = np.linalg.norm(ab)
-    norm_cb = np.linalg.norm(cb)
-    if norm_ab == 0 or norm_cb == 0:
-        return None
-
-    cosine_angle = np.dot(ab, cb) / (norm_ab * norm_cb)
-    angle = np.degrees(np.arccos(np.clip(cosine_angle, -1.0, 1.0)))
-    return angle
+    cross = ab[..., 0] * cb[..., 1] - ab[..., 1] * cb[..., 0]
+    dot = ab[..., 0] * cb[..., 0] + ab[..., 1] * cb[..., 1]
+    return np.degrees(np.arctan2(np.abs(cross), dot))
 
 
 def calculate_pixel_angle_from_points(a, b, c):
@@ -2,16 +2,18 @@
 # 職責: 作為 API 的入口點，接收請求並完全轉交給服務層處理。
 
 import logging
+from contextlib import asynccontextmanager
 from typing import Optional, List
 
-from fastapi import FastAPI, File, UploadFile, HTTPException, Form, Depends, Query, Body
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, File, UploadFile, HTTPException, Form, Depends, Query, Body, Request
+from fastapi.responses import Response
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
 from sqlalchemy.orm import Session
 from sqlalchemy.exc import SQLAlchemyError
 from pydantic import BaseModel
 import uvicorn
+import orjson
 
 # --- 從我們的「資料庫中心」和「服務中心」匯入 ---
 # 已更新為您最新的駝峰式檔名
@@ -28,7 +30,16 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 整個應用程式共用一個 AsyncClient，重用與 Pose / Ball API 之間的連線池
+    app.state.http = services.create_http_client()
+    try:
+        yield
+    finally:
+        await app.state.http.aclose()
+
+app = FastAPI(lifespan=lifespan)
 
 # CORS 設置
 app.add_middleware(
@@ -43,6 +54,7 @@ app.add_middleware(
 
 @app.post("/analyze-pitch/")
 async def analyze_pitch(
+    request: Request,
     db: Session = Depends(get_db),
     video_file: UploadFile = File(...), 
     player_name: str = Form(...),
@@ -58,12 +70,17 @@ async def analyze_pitch(
         
         analysis_result = await services.analyze_pitch_service(
             db=db,
+            http_client=request.app.state.http,
             video_file=video_file,
             player_name=player_name,
             benchmark_player_name=benchmark_player_name
         )
         
-        return JSONResponse(content=analysis_result)
+        # 分析結果含大量浮點數，以 orjson 序列化 (比標準 json 快，且能直接處理 numpy 數值)
+        return Response(
+            content=orjson.dumps(analysis_result, option=orjson.OPT_SERIALIZE_NUMPY),
+            media_type="application/json"
+        )
 
     except HTTPException as e:
         raise e
@@ -76,21 +93,16 @@ async def analyze_pitch(
 async def get_history_analyses(pitcher_name: str = None, db: Session = Depends(get_db)):
     # (此路由保留您同事的設計，不變)
     try:
-        history_records = crud.get_pitch_analyses(db, pitcher_name)
+        # 只查詢需要的欄位，直接把 Row 轉成 dict，不建立 ORM 物件
+        history_rows = crud.get_pitch_analysis_rows(db, pitcher_name)
         return [
             {
-                "id": record.id,
-                "video_path": record.video_path,
-                "max_speed_kmh": record.max_speed_kmh,
-                "pitch_score": record.pitch_score,
-                "ball_score": record.ball_score,
-                "biomechanics_features": record.biomechanics_features,
-                "pitcher_name": record.pitcher_name,
-                "release_frame_url": record.release_frame_url or "",
-                "landing_frame_url": record.landing_frame_url or "",
-                "shoulder_frame_url": record.shoulder_frame_url or ""
+                **row._mapping,
+                "release_frame_url": row.release_frame_url or "",
+                "landing_frame_url": row.landing_frame_url or "",
+                "shoulder_frame_url": row.shoulder_frame_url or ""
             }
-            for record in history_records
+            for row in history_rows
         ]
     except SQLAlchemyError as e:
         logger.error(f"無法獲取歷史紀錄: {e}", exc_info=True)
@@ -2,15 +2,18 @@
 # 職責: 處理所有核心商業邏輯，此版本已升級為數據驅動的評分模型。
 
 import os
-import shutil
+import time
+import uuid
+import threading
 import tempfile
 import asyncio
+from pathlib import Path
 import httpx
+import orjson
 import logging
 from typing import Dict, Optional, Tuple
 
 from sqlalchemy.orm import Session
-import joblib
 import numpy as np
 
 # --- 從我們的「資料庫中心」和「數據庫管家」匯入 ---
@@ -28,45 +31,113 @@ OUTPUT_VIDEO_DIR = "output_videos"
 POSE_API_URL = "http://localhost:8000/pose_video"
 BALL_API_URL = "http://localhost:8080/predict"
 API_TIMEOUT = 1800.0 
+HTTP_LIMITS = httpx.Limits(max_connections=32, max_keepalive_connections=16)
+BALL_MODEL_PATH = 'random_forest_model.pkl'
 
-try:
-    BALL_PREDICTION_MODEL = joblib.load('random_forest_model.pkl')
+# 比對模型快取：(投手, 球種) → (到期時間, PitchModel)，模型很少變動，不必每次請求都查資料庫
+PROFILE_MODEL_CACHE_TTL = 300.0
+PROFILE_MODEL_CACHE_MAXSIZE = 256
+_profile_model_cache: Dict[Tuple[str, str], Tuple[float, PitchModel]] = {}
+
+# 球路評分模型只載入一次；_BALL_MODEL_UNSET 代表尚未載入 (載入失敗則快取為 None)
+_BALL_MODEL_UNSET = object()
+_ball_model = _BALL_MODEL_UNSET
+_ball_model_lock = threading.Lock()
+
+def _get_ball_model():
+    """
+    第一次需要球路評分時才載入模型 (之後直接回傳快取)，不拖慢服務啟動。
+    載入會讀取並反序列化整個 .pkl，屬於阻塞操作，請在背景執行緒呼叫 (見 analyze_pitch_service)。
+    以鎖保護第一次載入，同時進來的請求不會各自重複載入。載入失敗時回傳 None。
+    """
+    global _ball_model
+    if _ball_model is _BALL_MODEL_UNSET:
+        with _ball_model_lock:
+            if _ball_model is _BALL_MODEL_UNSET:
+                _ball_model = _load_ball_model()
+    return _ball_model
+
+def _load_ball_model():
+    """
+    實際從磁碟載入球路評分模型，缺少 joblib 或 .pkl 時回傳 None。
+    """
+    try:
+        import joblib
+        model = joblib.load(BALL_MODEL_PATH)
+    except Exception as e:
+        logger.warning(f"⚠️ 警告：載入 .pkl 模型失敗: {e}。")
+        return None
+
+    # 特徵欄位順序固定 (x_0..x_n, y_0..y_n)，拿掉訓練時記錄的欄位名稱，
+    # classify_ball_quality 就能直接餵 ndarray，省去建立 DataFrame 與 sklearn 的欄名檢查
+    # 拿不掉也不影響評分 (classify_ball_quality 會改用 DataFrame)，只記錄警告
+    if hasattr(model, 'feature_names_in_'):
+        try:
+            del model.feature_names_in_
+        except AttributeError as e:
+            logger.warning(f"⚠️ 無法移除模型的 feature_names_in_: {e}。")
     logger.info("✅ 成功載入球路預測模型。")
-except Exception as e:
-    logger.warning(f"⚠️ 警告：載入 .pkl 模型失敗: {e}。")
-    BALL_PREDICTION_MODEL = None
+    return model
 
 # --- 核心服務函式 ---
 
-async def analyze_video_kinematics(video_bytes: bytes, filename: str) -> Tuple[Dict, Dict]:
+def create_http_client() -> httpx.AsyncClient:
+    """
+    建立整個應用程式共用的 AsyncClient (由 mainV2.py 在啟動時建立、關閉時釋放)，
+    讓每次分析都能重用與 Pose / Ball API 之間的 keep-alive 連線。
+    """
+    return httpx.AsyncClient(timeout=API_TIMEOUT, limits=HTTP_LIMITS)
+
+async def analyze_video_kinematics(client: httpx.AsyncClient, video_bytes: bytes, filename: str) -> Tuple[Dict, Dict]:
     """
     呼叫 Pose API，計算生物力學特徵，並同時回傳原始 pose_data 以供畫圖使用。
     """
     logger.info("服務層：(子任務) 正在呼叫 POSE API...")
-    async with httpx.AsyncClient(timeout=API_TIMEOUT) as client:
-        files = {"file": (filename, video_bytes, "video/mp4")}
-        response = await client.post(POSE_API_URL, files=files)
-        response.raise_for_status()
-        pose_data = response.json()
+    files = {"file": (filename, video_bytes, "video/mp4")}
+    response = await client.post(POSE_API_URL, files=files)
+    response.raise_for_status()
+    # 以 orjson 直接解析回應的 bytes，pose_data 有上萬個浮點數，比 response.json() 快得多
+    pose_data = orjson.loads(response.content)
     logger.info("服務層：(子任務) 正在計算生物力學特徵...")
-    biomechanics_features = extract_pitching_biomechanics(pose_data)
+    # 特徵計算是 CPU 工作，丟到背景執行緒執行，不阻塞事件迴圈 (Ball API 的請求可同時進行)
+    biomechanics_features = await asyncio.to_thread(extract_pitching_biomechanics, pose_data)
     return biomechanics_features, pose_data
 
-async def analyze_ball_flight(video_bytes: bytes, filename: str) -> Dict:
+async def analyze_ball_flight(client: httpx.AsyncClient, video_bytes: bytes, filename: str) -> Dict:
     """
     呼叫 Ball API 以獲取球路相關數據。
     """
     logger.info("服務層：(子任務) 正在呼叫 BALL API...")
-    async with httpx.AsyncClient(timeout=API_TIMEOUT) as client:
-        files = {"file": (filename, video_bytes, "video/mp4")}
-        response = await client.post(BALL_API_URL, files=files)
-        response.raise_for_status()
-        return response.json()
+    files = {"file": (filename, video_bytes, "video/mp4")}
+    response = await client.post(BALL_API_URL, files=files)
+    response.raise_for_status()
+    return orjson.loads(response.content)
 
 def get_comparison_model(db: Session, benchmark_player_name: str, detected_pitch_type: str) -> Optional[PitchModel]:
     """
     【修改後的輔助函式】
     透過 crud.py 智慧地從資料庫中尋找最適合的比對模型。
+    找到的模型會在程序內快取 PROFILE_MODEL_CACHE_TTL 秒，期間同一組 (投手, 球種) 不再查詢資料庫。
+    """
+    cache_key = (benchmark_player_name, detected_pitch_type)
+    now = time.monotonic()
+    cached = _profile_model_cache.get(cache_key)
+    if cached and cached[0] > now:
+        return cached[1]
+
+    profile_model = _load_comparison_model(db, benchmark_player_name, detected_pitch_type)
+    if profile_model:
+        # 從 session 中移除，之後 session commit / 關閉都不會讓快取中的物件過期
+        db.expunge(profile_model)
+        _profile_model_cache.pop(cache_key, None)
+        if len(_profile_model_cache) >= PROFILE_MODEL_CACHE_MAXSIZE:
+            _profile_model_cache.pop(next(iter(_profile_model_cache)))
+        _profile_model_cache[cache_key] = (now + PROFILE_MODEL_CACHE_TTL, profile_model)
+    return profile_model
+
+def _load_comparison_model(db: Session, benchmark_player_name: str, detected_pitch_type: str) -> Optional[PitchModel]:
+    """
+    實際查詢資料庫：先找 (投手 + 球種) 專屬模型，找不到再退回該投手的通用模型。
     """
     profile_model = None
     
@@ -77,78 +148,93 @@ def get_comparison_model(db: Session, benchmark_player_name: str, detected_pitch
         logger.info(f"服務層：正在嘗試載入球種專屬模型: {ideal_model_name}")
         profile_model = crud.get_pitch_model_by_name(db, model_name=ideal_model_name)
         if profile_model:
+            # 載入模型時就把 profile_data 整理成評分用的陣列
+            profile_model.score_arrays = build_profile_arrays(profile_model.profile_data)
             return profile_model
 
     # 2. 如果找不到專屬模型，或球種未知，則嘗試尋找該投手的「通用」模型作為備案
     fallback_model_name = f"{benchmark_player_name}_all_v1"
     logger.warning(f"找不到或未指定專屬模型，嘗試載入通用模型: {fallback_model_name}")
     profile_model = crud.get_pitch_model_by_name(db, model_name=fallback_model_name)
+    if profile_model:
+        profile_model.score_arrays = build_profile_arrays(profile_model.profile_data)
 
     return profile_model
 
-def calculate_score_from_comparison(features: dict, profile_data: dict) -> int:
+def build_profile_arrays(profile_data: dict) -> Tuple[Tuple[str, ...], np.ndarray, np.ndarray]:
+    """
+    把模型的 profile_data 整理成 (特徵名稱, mean 陣列, std 陣列)，供向量化評分使用。
+    只保留有 mean、std 且 std 不為 0 的特徵。
+    """
+    keys, means, stds = [], [], []
+    for key, profile_stats in (profile_data or {}).items():
+        if not profile_stats:
+            continue
+        mean = profile_stats.get('mean')
+        std = profile_stats.get('std')
+        if mean is None or std is None or std == 0:
+            continue
+        keys.append(key)
+        means.append(mean)
+        stds.append(std)
+    return tuple(keys), np.array(means, dtype=np.float64), np.array(stds, dtype=np.float64)
+
+def calculate_score_from_comparison(features: dict, profile_data: dict,
+                                    profile_arrays: Optional[Tuple[Tuple[str, ...], np.ndarray, np.ndarray]] = None) -> int:
     """
     【新的評分函式】
     根據使用者的特徵與標準模型的差距，計算出一個 0-100 的分數。
     差距越小，分數越高。
+    profile_arrays 為 build_profile_arrays 的結果，若呼叫端已預先算好可直接傳入。
     """
     if not profile_data:
         return 0 # 如果沒有模型可以比對，分數為 0
 
-    total_score = 0
-    feature_count = 0
+    keys, means, stds = profile_arrays if profile_arrays is not None else build_profile_arrays(profile_data)
 
-    for key, user_value in features.items():
-        # 只比對在模型中有定義的特徵
-        profile_stats = profile_data.get(key.lower())
-        if not profile_stats or user_value is None:
-            continue
-        
-        mean = profile_stats.get('mean')
-        std = profile_stats.get('std')
+    # 把使用者特徵依模型的特徵順序排成向量，缺值 (None 或模型中沒有) 以 NaN 表示
+    user_features = {key.lower(): value for key, value in features.items()}
+    user_vec = np.fromiter(
+        (np.nan if user_features.get(key) is None else user_features[key] for key in keys),
+        dtype=np.float64, count=len(keys)
+    )
+    valid = ~np.isnan(user_vec)
+    if not valid.any():
+        return 0
 
-        # 確保模型中有 mean 和 std，且 std 不為 0
-        if mean is None or std is None or std == 0:
-            continue
+    # 計算 Z-score，代表偏離了幾個標準差
+    z_scores = np.abs((user_vec[valid] - means[valid]) / stds[valid])
 
-        # 計算 Z-score，代表偏離了幾個標準差
-        z_score = abs((user_value - mean) / std)
-        
-        # 將 Z-score 轉換為 0-100 的分數
-        # 這裡使用一個簡單的轉換：Z-score 為 0 (完全符合平均) 得 100 分
-        # Z-score 每增加 1 (偏離一個標準差)，就扣 25 分 (可調整)
-        # 最低為 0 分
-        feature_score = max(0, 100 - z_score * 25)
-        
-        total_score += feature_score
-        feature_count += 1
-    
-    if feature_count == 0:
-        return 0
+    # 將 Z-score 轉換為 0-100 的分數
+    # 這裡使用一個簡單的轉換：Z-score 為 0 (完全符合平均) 得 100 分
+    # Z-score 每增加 1 (偏離一個標準差)，就扣 25 分 (可調整)
+    # 最低為 0 分
+    feature_scores = np.maximum(0, 100 - z_scores * 25)
 
     # 回傳所有特徵的平均分數
-    final_score = int(total_score / feature_count)
+    final_score = int(feature_scores.mean())
     return final_score
 
 
-async def analyze_pitch_service(db: Session, video_file, player_name: str, benchmark_player_name: Optional[str] = None) -> Dict:
+async def analyze_pitch_service(db: Session, http_client: httpx.AsyncClient, video_file, player_name: str, benchmark_player_name: Optional[str] = None) -> Dict:
     """
     【主服務函式】
     執行完整的投球分析、比對、渲染，並將所有結果打包回傳。
+    http_client 為應用程式共用的 AsyncClient (見 create_http_client)。
     """
-    # ... (步驟 1 的臨時檔邏輯不變)
+    # 步驟 1: 上傳的影片只讀進記憶體一次，API 呼叫直接使用這份 bytes
+    video_bytes = await video_file.read()
     with tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(video_file.filename)[1]) as temp_video_file:
         temp_video_path = temp_video_file.name
-        shutil.copyfileobj(video_file.file, temp_video_file)
+    # 只有渲染影片需要實體檔案，趁等待 API 時在背景執行緒寫入暫存檔
+    write_task = asyncio.ensure_future(asyncio.to_thread(Path(temp_video_path).write_bytes, video_bytes))
     try:
-        with open(temp_video_path, "rb") as f:
-            video_bytes = f.read()
-        
         # 步驟 2: 並行呼叫 API
         (kinematics_results, ball_data) = await asyncio.gather(
-            analyze_video_kinematics(video_bytes, video_file.filename),
-            analyze_ball_flight(video_bytes, video_file.filename)
+            analyze_video_kinematics(http_client, video_bytes, video_file.filename),
+            analyze_ball_flight(http_client, video_bytes, video_file.filename)
         )
+        await write_task
         biomechanics_features, pose_data = kinematics_results
         detected_pitch_type = ball_data.get("predicted_pitch_type", "Unknown")
         
@@ -163,24 +249,38 @@ async def analyze_pitch_service(db: Session, video_file, player_name: str, bench
             profile_data_for_frontend = profile_model.profile_data
             pitch_score = calculate_score_from_comparison(
                 features=biomechanics_features,
-                profile_data=profile_data_for_frontend
+                profile_data=profile_data_for_frontend,
+                profile_arrays=profile_model.score_arrays
             )
         else:
             logger.warning(f"在資料庫中找不到任何可用的比對模型 (比對對象: {comparison_target_name})，pitch_score 將設為 0。")
 
         ball_score = 0
-        if BALL_PREDICTION_MODEL:
-            ball_score = classify_ball_quality(ball_data, BALL_PREDICTION_MODEL)
+        # 第一次呼叫會從磁碟載入模型，放到背景執行緒以免阻塞事件迴圈
+        ball_model = await asyncio.to_thread(_get_ball_model)
+        if ball_model:
+            ball_score = classify_ball_quality(ball_data, ball_model)
         else:
             logger.warning("球路評分模型未載入，ball_score 將設為 0。")
 
         # 步驟 5: 渲染影片
         output_filename = f"rendered_{video_file.filename}"
         output_video_path = os.path.join(OUTPUT_VIDEO_DIR, output_filename)
-        rendered_video_path, max_speed_kmh = render_video_with_pose_and_max_ball_speed(
-            input_video_path=temp_video_path, pose_json=pose_data,
-            ball_json=ball_data, output_video_path=output_video_path
-        )
+        # 同檔名的請求可能同時在渲染，先寫到本次請求專屬的檔案，完成後再以 os.replace 原子地換到正式路徑
+        render_tmp_path = os.path.join(OUTPUT_VIDEO_DIR, f".{uuid.uuid4().hex}_{output_filename}")
+        try:
+            # 渲染同樣是長時間的 CPU / 磁碟工作，放到背景執行緒，期間仍可服務其他請求
+            _, max_speed_kmh = await asyncio.to_thread(
+                render_video_with_pose_and_max_ball_speed,
+                input_video_path=temp_video_path, pose_json=pose_data,
+                ball_json=ball_data, output_video_path=render_tmp_path
+            )
+            os.replace(render_tmp_path, output_video_path)
+        except BaseException:
+            if os.path.exists(render_tmp_path):
+                os.remove(render_tmp_path)
+            raise
+        rendered_video_path = output_video_path
         
         # 步驟 6: 組合最終回傳給 API 層的結果字典
         final_result = {
@@ -203,5 +303,7 @@ async def analyze_pitch_service(db: Session, video_file, player_name: str, bench
         return final_result
 
     finally:
+        # API 失敗時寫檔執行緒可能還在跑，必須等它結束再刪檔，否則暫存檔會被重新建立而殘留
+        await asyncio.gather(write_task, return_exceptions=True)
         if os.path.exists(temp_video_path):
             os.remove(temp_video_path)